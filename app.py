@@ -1,34 +1,126 @@
 import dash
-from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash import dcc, html, Patch
+from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
+import atexit
+import os
+import queue
 import threading
 import time
-from collections import deque
+import traceback
+import base64
 import csv
+from collections import deque
 from datetime import datetime
+from functools import lru_cache
 import numpy as np
-import math
 from serial import Serial
-from scipy.signal import butter, filtfilt, find_peaks
+from scipy.signal import butter, sosfilt_zi
 from pyshimmer import ShimmerBluetooth, DEFAULT_BAUDRATE, DataPacket, EChannelType
 from pyshimmer.dev.channels import ESensorGroup
 
+try:
+    from numba import njit
+except ImportError:  # Numba is optional, the kernels below also run as plain Python
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
 alerts = []
 last_breath_time = time.time()
+last_alert_time = float("-inf")
 
 # Parameters
 SAMPLE_RATE = 48.72  # Hz
 BUFFER_SIZE = int(120 * SAMPLE_RATE)  # Two minutes of data
 LOW_CUT, HIGH_CUT = 0.1, 0.5  # Bandpass filter range (Hz)
-MIN_PEAK_DISTANCE = int(1.5 * SAMPLE_RATE)  # Minimum peak distance (in samples)
+# The bandpassed signal has nothing above ~1 Hz, so peak detection and plotting
+# work on every DECIMATION_FACTOR-th filtered sample
+DECIMATION_FACTOR = 8
+DECIMATED_RATE = SAMPLE_RATE / DECIMATION_FACTOR  # Hz
+MIN_PEAK_DISTANCE = int(1.5 * DECIMATED_RATE)  # Minimum peak distance (in decimated samples)
 MIN_AMPLITUDE_CHANGE = 0.008  # Default minimum amplitude change
-
-# Thread-safe deques for sliding windows
-data_buffer = deque(maxlen=BUFFER_SIZE)
-x_data_buffer = deque(maxlen=BUFFER_SIZE)
-y_data_buffer = deque(maxlen=BUFFER_SIZE)
-z_data_buffer = deque(maxlen=BUFFER_SIZE)
+DEFAULT_WINDOW_SIZE = 60  # Default sliding window (s)
+DETECTION_INTERVAL = 1.0  # Time between breath detection runs, matches the UI refresh (s)
+INGEST_INTERVAL = 0.25  # Time dsp_thread lets readings queue up before moving them to the ring (s)
+# Breath rate comes from the first autocorrelation peak with a period in this range (s),
+# falling back to the peak count when that peak is weaker than MIN_AUTOCORRELATION
+MIN_BREATH_PERIOD, MAX_BREATH_PERIOD = 0.75, 20
+MIN_AUTOCORRELATION = 0.3
+# The autocorrelation rate also needs MIN_RATE_BREATHS detected breaths whose median
+# spacing gives a rate within RATE_TOLERANCE of it
+MIN_RATE_BREATHS = 3
+RATE_TOLERANCE = 0.25
+MIN_ALERT_INTERVAL = 5  # Minimum time between logged alerts (s)
+STALL_TIMEOUT = 10  # Time without new samples before the sensor is reported as silent (s)
+SAMPLE_PERIOD = np.float32(1.0 / SAMPLE_RATE)  # s
+# The respiratory trace is sent as int16: PLOT_SCALE counts per unit of amplitude,
+# which maps the [-1, 1] y-axis range onto the full int16 range
+PLOT_SCALE = 32767
+MAX_PLOT_POINTS = 1000  # Longer traces are downsampled with LTTB before plotting
+FILTER_ORDER = 4
+ACCEL_SCALE = 9.81 / 16000  # Raw accelerometer units to m/s^2
+
+# Filter coefficients depend only on constants, so design them once at import.
+# Second-order sections stay well conditioned at LOW_CUT/nyquist ~ 0.004.
+BANDPASS_SOS = butter(FILTER_ORDER, [LOW_CUT, HIGH_CUT], btype="band", fs=SAMPLE_RATE, output="sos")
+BANDPASS_ZI = sosfilt_zi(BANDPASS_SOS)  # Steady-state filter memory for a unit step
+
+# Preallocated ring buffer for the sliding window, written by dsp_thread.
+# Each row holds one sample: x, y, z and the absolute acceleration.
+# samples_written only ever grows, so a single read of it gives a consistent
+# write position (samples_written % BUFFER_SIZE) and fill level.
+COLUMN_X, COLUMN_Y, COLUMN_Z, COLUMN_ABSOLUTE = range(4)
+sample_buffer = np.zeros((BUFFER_SIZE, 4), dtype=np.float32)
+samples_written = 0
+# The x, y, z columns are only plotted in debug mode, so they are only written while
+# it is on; debug_since is the first sample written since it was turned on (None while off)
+DEBUG_ENABLED = threading.Event()
+debug_since = None
+
+# shimmer_handler only queues the raw readings, so the Bluetooth thread never waits
+# on NumPy work; dsp_thread is the only thread that touches the ring buffers
+RAW_Q = queue.SimpleQueue()
+
+
+def read_window(buffer, size, written):
+    """Return the newest `size` samples of a ring buffer in chronological order."""
+    # A view into the buffer unless the window wraps around its end
+    size = min(size, written, BUFFER_SIZE)
+    end = written % BUFFER_SIZE
+    start = end - size
+    if start >= 0:
+        return buffer[start:end]
+    return np.concatenate((buffer[start:], buffer[:end]))
+
+
+def write_window(buffer, values, written):
+    """Store `values` in a ring buffer starting at absolute sample index `written`."""
+    start = written % BUFFER_SIZE
+    head = min(len(values), BUFFER_SIZE - start)
+    buffer[start:start + head] = values[:head]
+    buffer[:len(values) - head] = values[head:]
+
+
+# Bandpass-filtered copy of the absolute acceleration column, advanced incrementally by filter_new_samples()
+filtered_buffer = np.zeros(BUFFER_SIZE, dtype=np.float32)
+filtered_written = 0
+filter_state = None
+
+# Breath peaks as (decimated sample index, value), extended incrementally by update_breath_peaks().
+# Decimated sample d is absolute sample d * DECIMATION_FACTOR.
+breath_peaks = deque()
+peaks_scanned = 0  # Next decimated sample to test as a peak
+peak_threshold = None
+
+# Settings chosen in the UI, swapped as a whole by the Dash callback
+detection_settings = (DEFAULT_WINDOW_SIZE, MIN_AMPLITUDE_CHANGE)
+# Newest result of dsp_thread; a fresh dict is published each run and never mutated
+latest_result = None
+# Sample count seen by the previous process_window() run and when it last advanced
+last_written = 0
+last_written_time = None
 
 # Dash app setup
 app = dash.Dash(__name__)
@@ -43,6 +135,46 @@ dark_style = {
     "min-height": "100vh",
 }
 
+# The chart is built once; update_all_outputs only patches trace data into it
+DEBUG_TRACE_NAMES = ("Sygnał X", "Sygnał Y", "Sygnał Z")
+# Podział wysokości wykresu: w trybie debug osie x, y, z mają własny panel pod sygnałem
+# filtrowanym, ze wspólną osią czasu, zamiast nakładać się na niego
+MAIN_DOMAIN = {False: [0, 1], True: [0.4, 1]}
+DEBUG_DOMAIN = [0, 0.32]
+
+initial_figure = {
+    "data": [
+        {"x": [], "y": [], "type": "scattergl", "name": "Filtrowany Sygnał"},
+    ] + [
+        # Surowe osie mają własny panel i skalę (m/s²), nie kwantyzowaną
+        {"x": [], "y": [], "type": "scattergl", "yaxis": "y2", "name": name, "visible": False}
+        for name in DEBUG_TRACE_NAMES
+    ],
+    "layout": {
+        "title": "Sygnał Oddechowy",
+        "xaxis": {"title": "Czas (s)", "color": dark_style["color"], "gridcolor": "#444"},
+        "yaxis": {
+            "title": "Amplituda",
+            "domain": MAIN_DOMAIN[False],
+            "range": [-PLOT_SCALE, PLOT_SCALE],
+            "tickvals": [tick * PLOT_SCALE for tick in (-1, -0.5, 0, 0.5, 1)],
+            "ticktext": ["-1", "-0.5", "0", "0.5", "1"],
+            "color": dark_style["color"],
+            "gridcolor": "#444",
+        },
+        "yaxis2": {
+            "title": "Przyspieszenie (m/s²)",
+            "domain": DEBUG_DOMAIN,
+            "visible": False,
+            "color": dark_style["color"],
+            "gridcolor": "#444",
+        },
+        "paper_bgcolor": dark_style["background-color"],
+        "plot_bgcolor": "#2e2e2e",
+        "font": {"color": dark_style["color"]},
+    },
+}
+
 # Main layout
 app.layout = html.Div(
     children=[
@@ -73,6 +205,7 @@ app.layout = html.Div(
         ),
         dcc.Graph(
             id="respiratory-chart",
+            figure=initial_figure,
             style={"backgroundColor": "#2e2e2e", "padding": "10px", "border-radius": "5px"},
             config={"displayModeBar": False},
         ),
@@ -88,7 +221,7 @@ app.layout = html.Div(
                             min=5,
                             max=120,
                             step=1,
-                            value=60,
+                            value=DEFAULT_WINDOW_SIZE,
                             marks={i: f"{i}s" for i in range(5, 121, 15)},
                             tooltip={"placement": "bottom", "always_visible": True},
                         ),
@@ -132,6 +265,8 @@ app.layout = html.Div(
             style={"padding": "20px", "background-color": "#2e2e2e", "border": "1px solid #444", "border-radius": "5px"}
         ),
         dcc.Interval(id="update-interval", interval=1000, n_intervals=0),
+        # What this browser already shows: result sequence and time axis shape
+        dcc.Store(id="plot-state"),
     ],
     style=dark_style,
 )
@@ -155,12 +290,23 @@ def toggle_settings_visibility(n_clicks):
     # Hide settings container for even number of clicks or no clicks
     return {"margin-top": "20px", "display": "none"}
 
+def typed_array(values, dtype="<f4"):
+    """Encode an array as a plotly.js typed-array spec instead of a JSON list of numbers."""
+    array = np.ascontiguousarray(values, dtype=dtype)
+    return {"dtype": array.dtype.str[1:], "bdata": base64.b64encode(array.tobytes()).decode("ascii")}
+
+@lru_cache(maxsize=128)
+def respiratory_time_axis(window_length, offset):
+    """Encoded time axis of the decimated respiratory trace for one window shape."""
+    return typed_array(np.arange(offset, window_length, DECIMATION_FACTOR, dtype=np.float32) * SAMPLE_PERIOD)
+
 # Callback to update outputs
 @app.callback(
     [
         Output("respiratory-chart", "figure"),
         Output("breath-count", "children"),
         Output("breath-frequency", "children"),
+        Output("plot-state", "data"),
     ],
     [
         Input("update-interval", "n_intervals"),
@@ -168,115 +314,370 @@ def toggle_settings_visibility(n_clicks):
         Input("min-amplitude-slider", "value"),
         Input("debug-toggle", "value"),
     ],
+    State("plot-state", "data"),
 )
 
-def update_all_outputs(n_intervals, window_size_seconds, min_amplitude_change, debug_toggle):
-    buffer_size = int(window_size_seconds * SAMPLE_RATE)
-
-    # Pobieranie danych z buforów
-    data = list(data_buffer)[-buffer_size:]
-    x_data = list(x_data_buffer)[-buffer_size:]
-    y_data = list(y_data_buffer)[-buffer_size:]
-    z_data = list(z_data_buffer)[-buffer_size:]
+def update_all_outputs(n_intervals, window_size_seconds, min_amplitude_change, debug_toggle, plot_state):
+    global detection_settings
+    detection_settings = (window_size_seconds, min_amplitude_change)
+    if "debug" in debug_toggle:
+        DEBUG_ENABLED.set()
+    else:
+        DEBUG_ENABLED.clear()
 
-    # Walidacja rozmiaru buforów
-    if len(data) < SAMPLE_RATE or len(x_data) < SAMPLE_RATE or len(y_data) < SAMPLE_RATE or len(z_data) < SAMPLE_RATE:
+    # Wynik wykrywania oddechów liczony w tle przez dsp_thread
+    result = latest_result
+    if result is None:
         return dash.no_update
-
-    # Wykrywanie oddechów
-    breath_count, filtered_signal = detect_breaths(data, SAMPLE_RATE, min_amplitude_change)
-    breath_frequency = (breath_count / window_size_seconds) * 60
-
-    # Oś czasu
-    time_axis = [i / SAMPLE_RATE for i in range(len(filtered_signal))]
-
-    # Tworzenie wykresu
-    respiratory_figure = {
-        "data": [
-            {"x": time_axis, "y": filtered_signal, "type": "scattergl", "name": "Filtrowany Sygnał"},
-        ],
-        "layout": {
-            "title": "Sygnał Oddechowy",
-            "xaxis": {"title": "Czas (s)", "color": dark_style["color"], "gridcolor": "#444"},
-            "yaxis": {"title": "Amplituda", "range": [-1, 1], "color": dark_style["color"], "gridcolor": "#444"},
-            "paper_bgcolor": dark_style["background-color"],
-            "plot_bgcolor": "#2e2e2e",
-            "font": {"color": dark_style["color"]},
-        },
-    }
-
-    # Dodanie sygnałów x, y, z do wykresu, jeśli włączony debug
-    if "debug" in debug_toggle:
-        respiratory_figure["data"].extend([
-            {"x": time_axis, "y": x_data, "type": "scattergl", "name": "Sygnał X"},
-            {"x": time_axis, "y": y_data, "type": "scattergl", "name": "Sygnał Y"},
-            {"x": time_axis, "y": z_data, "type": "scattergl", "name": "Sygnał Z"},
-        ])
+    # Bez nowych próbek ani zmiany ustawień nie ma czego odświeżać
+    plot_state = plot_state or {}
+    if dash.callback_context.triggered_id == "update-interval" and plot_state.get("sequence") == result["sequence"]:
+        raise PreventUpdate
+    filtered_signal = result["filtered_signal"]
+    breath_count = result["breath_count"]
+    breath_frequency = result["breath_frequency"]
+
+    # Aktualizacja tylko danych wykresu, układ jest już w przeglądarce
+    respiratory_figure = Patch()
+
+    # Oś czasu (sygnał filtrowany jest zdecymowany, osie x, y, z nie). Zależy tylko
+    # od długości okna i przesunięcia decymacji, więc wysyłana jest tylko po ich zmianie.
+    time_axis_key = [result["window_length"], result["offset"]]
+    if time_axis_key != plot_state.get("time_axis"):
+        respiratory_figure["data"][0]["x"] = respiratory_time_axis(result["window_length"], result["offset"])
+
+    # Kwantyzacja do int16 (oś y jest opisana w oryginalnych jednostkach)
+    quantized_signal = np.clip(filtered_signal * PLOT_SCALE, -32768, 32767).astype(np.int16)
+    respiratory_figure["data"][0]["y"] = typed_array(quantized_signal, "<i2")
+
+    # Sygnały x, y, z, jeśli włączony debug. Surowe okno jest przygotowywane
+    # przez dsp_thread, więc pojawia się dopiero po jego kolejnym przebiegu.
+    debug_traces = result["debug_traces"]
+    show_debug = "debug" in debug_toggle and debug_traces is not None
+    # Oś czasu przechodzi pod dolny panel, więc oba panele ją współdzielą
+    respiratory_figure["layout"]["xaxis"]["anchor"] = "y2" if show_debug else "y"
+    respiratory_figure["layout"]["yaxis"]["domain"] = MAIN_DOMAIN[show_debug]
+    respiratory_figure["layout"]["yaxis2"]["visible"] = show_debug
+    for index in range(1, len(DEBUG_TRACE_NAMES) + 1):
+        respiratory_figure["data"][index]["visible"] = show_debug
+    if show_debug:
+        for index, (trace_time, trace_values) in enumerate(debug_traces, start=1):
+            respiratory_figure["data"][index]["x"] = typed_array(trace_time)
+            respiratory_figure["data"][index]["y"] = typed_array(trace_values)
 
     breath_text = f"Liczba Wykrytych Oddechów: {breath_count}"
     frequency_text = f"Częstotliwość Oddechów: {breath_frequency:.2f} oddechów na minutę"
-    return respiratory_figure, breath_text, frequency_text
+    plot_state = {"sequence": result["sequence"], "time_axis": time_axis_key}
+    return respiratory_figure, breath_text, frequency_text, plot_state
+
+# Alert log, opened once and line buffered so every alert still reaches the disk
+ALERTS_FILE = "alerts.csv"
+alerts_file = open(ALERTS_FILE, "a", newline="", buffering=1)
+alerts_writer = csv.writer(alerts_file)
+if os.stat(ALERTS_FILE).st_size == 0:  # Add header only if file is empty
+    alerts_writer.writerow(["timestamp", "message"])
+atexit.register(alerts_file.close)
 
 def log_alert(message):
+    global last_alert_time
+    now = time.monotonic()
+    if now - last_alert_time < MIN_ALERT_INTERVAL:
+        return
+    last_alert_time = now
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    alert_entry = {"timestamp": timestamp, "message": message}
-    alerts.append(alert_entry)
-    with open("alerts.csv", "a", newline="") as file:
-        writer = csv.DictWriter(file, fieldnames=["timestamp", "message"])
-        if file.tell() == 0:  # Add header only if file is empty
-            writer.writeheader()
-        writer.writerow(alert_entry)
+    alerts.append({"timestamp": timestamp, "message": message})
+    alerts_writer.writerow([timestamp, message])
 
 # Signal processing functions
-def butter_bandpass(lowcut, highcut, fs, order=4):
-    nyquist = 0.5 * fs
-    low = lowcut / nyquist
-    high = highcut / nyquist
-    return butter(order, [low, high], btype="band")
-
-def bandpass_filter(data, lowcut, highcut, fs, order=4):
-    b, a = butter_bandpass(lowcut, highcut, fs, order=order)
-    return filtfilt(b, a, data)
-
-import numpy as np
-import time
-from scipy.signal import find_peaks
-
-def detect_breaths(data, sample_rate, min_amplitude_change):
-    # Apply bandpass filter
-    filtered_signal = bandpass_filter(data, LOW_CUT, HIGH_CUT, sample_rate)
-
-    # Smooth the signal with a moving average
-    smoothed_signal = np.convolve(filtered_signal, np.ones(5) / 5, mode='same')
-
-    # Find peaks
-    peaks, _ = find_peaks(smoothed_signal, distance=MIN_PEAK_DISTANCE, height=min_amplitude_change)
-
-    # Determine the time window for the last 10 seconds in samples
+@njit(cache=True, fastmath=True)
+def sos_filter(sos, samples, state):
+    """Forward-only second-order-section cascade, equivalent to scipy's sosfilt."""
+    # `state` has sosfilt's zi layout and is updated in place
+    filtered = np.empty(len(samples))
+    for n in range(len(samples)):
+        x = samples[n]
+        for k in range(sos.shape[0]):
+            y = sos[k, 0] * x + state[k, 0]
+            state[k, 0] = sos[k, 1] * x - sos[k, 4] * y + state[k, 1]
+            state[k, 1] = sos[k, 2] * x - sos[k, 5] * y
+            x = y
+        filtered[n] = x
+    return filtered
+
+def filter_new_samples():
+    """Bandpass the samples that arrived since the last call and return how many are filtered."""
+    global filtered_written, filter_state
+    written = samples_written
+    pending = written - filtered_written
+    if pending <= 0:
+        return filtered_written
+    if pending > BUFFER_SIZE:
+        # The ring has been overwritten since the last call, restart the filter
+        pending = BUFFER_SIZE
+        filter_state = None
+    new_samples = np.ascontiguousarray(read_window(sample_buffer, pending, written)[:, COLUMN_ABSOLUTE])
+    if filter_state is None:
+        filter_state = BANDPASS_ZI * new_samples[0]
+    filtered = sos_filter(BANDPASS_SOS, new_samples, filter_state)
+    write_window(filtered_buffer, filtered, written - pending)
+    filtered_written = written
+    return written
+
+@njit(cache=True)
+def lttb_indices(values, n_out):
+    """Pick `n_out` indices of an evenly sampled trace with Largest-Triangle-Three-Buckets."""
+    # The first and last samples are always kept
+    n = len(values)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    bucket_size = (n - 2) / (n_out - 2)
+    previous = 0
+    for i in range(n_out - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        next_end = n if i == n_out - 3 else int((i + 2) * bucket_size) + 1
+        # Average point of the next bucket
+        average_x = 0.0
+        average_y = 0.0
+        for j in range(end, next_end):
+            average_x += j
+            average_y += values[j]
+        average_x /= next_end - end
+        average_y /= next_end - end
+
+        best_area = -1.0
+        for j in range(start, end):
+            area = abs((previous - average_x) * (values[j] - values[previous])
+                       - (previous - j) * (average_y - values[previous]))
+            if area > best_area:
+                best_area = area
+                indices[i + 1] = j
+        previous = indices[i + 1]
+    indices[n_out - 1] = n - 1
+    return indices
+
+def downsample_trace(values, start=0):
+    """Return (time axis, values) of a raw trace reduced to at most MAX_PLOT_POINTS points."""
+    # `start` is the trace's first sample, counted from the window start
+    indices = lttb_indices(values, MAX_PLOT_POINTS)
+    return (indices + start).astype(np.float32) * SAMPLE_PERIOD, values[indices]
+
+def update_breath_peaks(written, min_amplitude_change):
+    """Add the peaks among the newly filtered decimated samples to breath_peaks."""
+    global peaks_scanned, peak_threshold
+    first_kept = max(-(-(written - BUFFER_SIZE) // DECIMATION_FACTOR), 0)
+    end = -(-written // DECIMATION_FACTOR)
+    # Start over on a new threshold or when the samples to continue from were overwritten
+    if min_amplitude_change != peak_threshold or peaks_scanned - 1 < first_kept:
+        breath_peaks.clear()
+        peaks_scanned = first_kept + 1
+        peak_threshold = min_amplitude_change
+    if end - peaks_scanned < 2:
+        return
+
+    # Decimated samples from the left neighbour of the first untested one onwards
+    start = (peaks_scanned - 1) * DECIMATION_FACTOR
+    signal = read_window(filtered_buffer, written - start, written)[::DECIMATION_FACTOR].tolist()
+    for i in range(1, len(signal) - 1):
+        value = signal[i]
+        if value < min_amplitude_change or value <= signal[i - 1] or value < signal[i + 1]:
+            continue
+        index = peaks_scanned + i - 1
+        # Of two peaks closer than MIN_PEAK_DISTANCE only the higher one is kept
+        if breath_peaks and index - breath_peaks[-1][0] < MIN_PEAK_DISTANCE:
+            if value > breath_peaks[-1][1]:
+                breath_peaks[-1] = (index, value)
+            continue
+        breath_peaks.append((index, value))
+    peaks_scanned += len(signal) - 2
+
+    while breath_peaks and breath_peaks[0][0] < first_kept:
+        breath_peaks.popleft()
+
+def detect_breaths(window_start, window_end, sample_rate):
+    # Peaks are found over the whole ring; the window's breaths are the ones inside it
+    window_peaks = []
+    for index, _ in reversed(breath_peaks):
+        if index < window_start:
+            break
+        window_peaks.append(index)
+    window_peaks.reverse()
+
+    # Determine where the last 10 seconds start, in decimated samples
     samples_in_10_seconds = int(10 * sample_rate)
-    recent_signal = smoothed_signal[-samples_in_10_seconds:]  # Extract the last 10 seconds of signal
-
-    # Find peaks in the recent signal
-    recent_peaks, _ = find_peaks(recent_signal, distance=MIN_PEAK_DISTANCE, height=min_amplitude_change)
+    recent_start = window_end - samples_in_10_seconds
 
-    # Check for no-breath alert
-    if len(recent_peaks) == 0:
+    # Check for no-breath alert; only the newest peak matters
+    no_breath = not window_peaks or window_peaks[-1] < recent_start
+    if no_breath:
         log_alert("Brak oddechu przez ostatnie 10 sekund!")
 
-    return len(peaks), smoothed_signal
+    return window_peaks, no_breath
+
+def estimate_breath_rate(filtered_signal, sample_rate):
+    """Breaths per minute from the autocorrelation of the window, or None if it has no clear period."""
+    # Autocorrelation through the power spectrum
+    n = len(filtered_signal)
+    spectrum = np.fft.rfft(filtered_signal - filtered_signal.mean(), n=2 * n)
+    autocorrelation = np.fft.irfft(spectrum.real ** 2 + spectrum.imag ** 2)[:n]
+    if autocorrelation[0] <= 0:
+        return None
+    autocorrelation /= autocorrelation[0]
+
+    min_lag = max(int(MIN_BREATH_PERIOD * sample_rate), 1)
+    max_lag = min(int(MAX_BREATH_PERIOD * sample_rate), n - 2)
+    lags = np.arange(min_lag, max_lag + 1)
+    if len(lags) == 0:
+        return None
+    is_peak = (autocorrelation[lags] > autocorrelation[lags - 1]) & (autocorrelation[lags] >= autocorrelation[lags + 1])
+    is_peak &= autocorrelation[lags] >= MIN_AUTOCORRELATION
+    if not is_peak.any():
+        return None
+
+    # Refine the first peak's lag with a parabola through its neighbours
+    lag = lags[np.argmax(is_peak)]
+    before, peak, after = autocorrelation[lag - 1:lag + 2]
+    curvature = before - 2 * peak + after
+    period = lag + (0.5 * (before - after) / curvature if curvature < 0 else 0.0)
+    return 60 * sample_rate / period
+
+def process_window():
+    """Filter the new samples and publish breath detection for the current window."""
+    global latest_result, last_written, last_written_time
+    settings = detection_settings
+    window_size_seconds, min_amplitude_change = settings
+    buffer_size = int(window_size_seconds * SAMPLE_RATE)
+    debug = DEBUG_ENABLED.is_set()
+    previous = latest_result
+
+    written = filter_new_samples()
+    # A stalled sensor or a dropped link must still raise an alert, even though
+    # the result below is not recomputed without new samples
+    now = time.monotonic()
+    if written != last_written or last_written_time is None:
+        last_written, last_written_time = written, now
+    elif now - last_written_time >= STALL_TIMEOUT:
+        log_alert(f"Brak danych z czujnika przez ostatnie {STALL_TIMEOUT} sekund!")
+
+    # Same samples with the same settings would give the same result
+    source = (written, settings, debug)
+    if previous is not None and previous["source"] == source:
+        return
+    raw_window = None
+    if debug and debug_since is not None and written > debug_since:
+        # Older rows hold stale or zero x, y, z from before debug mode was turned on
+        raw_window = read_window(sample_buffer, min(buffer_size, written - debug_since), written).copy()
+
+    update_breath_peaks(written, min_amplitude_change)
+
+    filtered_window = read_window(filtered_buffer, buffer_size, written)
+    if len(filtered_window) < SAMPLE_RATE:
+        return
+
+    # Decimate on the absolute sample grid so the kept samples don't shift between runs.
+    # The copy detaches the result from the ring, which keeps advancing.
+    offset = (len(filtered_window) - written) % DECIMATION_FACTOR
+    filtered_signal = filtered_window[offset::DECIMATION_FACTOR].copy()
+    window_start = (written - len(filtered_window) + offset) // DECIMATION_FACTOR
+    window_peaks, no_breath = detect_breaths(window_start, window_start + len(filtered_signal), DECIMATED_RATE)
+    breath_count = len(window_peaks)
+
+    # Bandpassed sensor noise can look periodic too, so the autocorrelation rate is only
+    # used while breathing is detected and the spacing of the detected breaths agrees with it
+    breath_frequency = None
+    if not no_breath and breath_count >= MIN_RATE_BREATHS:
+        spacing_rate = 60 * DECIMATED_RATE / np.median(np.diff(window_peaks))
+        breath_frequency = estimate_breath_rate(filtered_signal, DECIMATED_RATE)
+        if breath_frequency is not None and abs(breath_frequency - spacing_rate) > RATE_TOLERANCE * spacing_rate:
+            breath_frequency = None
+    if breath_frequency is None:
+        breath_frequency = (breath_count / window_size_seconds) * 60
+
+    debug_traces = None
+    if raw_window is not None:
+        raw_start = len(filtered_window) - len(raw_window)
+        debug_traces = [downsample_trace(raw_window[:, column], raw_start) for column in (COLUMN_X, COLUMN_Y, COLUMN_Z)]
+
+    latest_result = {
+        "sequence": 0 if previous is None else previous["sequence"] + 1,
+        "source": source,
+        "window_length": len(filtered_window),
+        "offset": offset,
+        "filtered_signal": filtered_signal,
+        "debug_traces": debug_traces,
+        "breath_count": breath_count,
+        "breath_frequency": breath_frequency,
+    }
+
+def ingest_samples(first):
+    """Move `first` and every other queued reading into sample_buffer."""
+    global samples_written, debug_since
+    readings = [first]
+    while len(readings) < BUFFER_SIZE:
+        try:
+            readings.append(RAW_Q.get_nowait())
+        except queue.Empty:
+            break
+
+    accel = np.array(readings, dtype=np.float32)
+    accel *= ACCEL_SCALE
+    absolute = np.sqrt(np.einsum("ij,ij->i", accel, accel))
+    if DEBUG_ENABLED.is_set():
+        if debug_since is None:
+            debug_since = samples_written
+        write_window(sample_buffer[:, :COLUMN_ABSOLUTE], accel, samples_written)
+    else:
+        debug_since = None
+    write_window(sample_buffer[:, COLUMN_ABSOLUTE], absolute, samples_written)
+    samples_written += len(readings)
+
+def warm_up_kernels():
+    """Compile the Numba kernels for the argument types dsp_thread uses, before the first samples arrive."""
+    sos_filter(BANDPASS_SOS, np.zeros(1, dtype=np.float32), BANDPASS_ZI.copy())
+    # Debug traces are column views of the copied raw window
+    downsample_trace(np.zeros((MAX_PLOT_POINTS + 1, 4), dtype=np.float32)[:, COLUMN_X])
+
+def dsp_thread():
+    # On Linux, keep this thread on the last core the process may use (no-op elsewhere)
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {max(os.sched_getaffinity(0))})
+    warm_up_kernels()
+    next_detection = time.monotonic()
+    while True:
+        try:
+            try:
+                first = RAW_Q.get(timeout=DETECTION_INTERVAL)
+            except queue.Empty:
+                pass
+            else:
+                # Let the readings pile up so each batch carries about a dozen of them
+                time.sleep(INGEST_INTERVAL)
+                ingest_samples(first)
+            now = time.monotonic()
+            if now < next_detection:
+                # Keep the filtered ring current between detection runs
+                filter_new_samples()
+                continue
+            next_detection = now + DETECTION_INTERVAL
+            process_window()
+        except Exception as error:
+            # One failed pass must not stop breath detection and its alerts for good
+            traceback.print_exc()
+            try:
+                log_alert(f"Błąd przetwarzania sygnału: {error}")
+            except Exception:
+                pass  # log_alert lists the alert before writing the CSV, so it is still shown
 
 
 # Shimmer thread initialization
 def shimmer_handler(pkt: DataPacket):
-    accel_x = pkt[EChannelType.ACCEL_LSM303DLHC_X] * 9.81 / 16000
-    accel_y = pkt[EChannelType.ACCEL_LSM303DLHC_Y] * 9.81 / 16000
-    accel_z = pkt[EChannelType.ACCEL_LSM303DLHC_Z] * 9.81 / 16000
-    absolute_acceleration = math.sqrt(accel_x**2 + accel_y**2 + accel_z**2)
-
-    data_buffer.append(absolute_acceleration)
-    x_data_buffer.append(accel_x)
-    y_data_buffer.append(accel_y)
-    z_data_buffer.append(accel_z)
+    RAW_Q.put_nowait((
+        pkt[EChannelType.ACCEL_LSM303DLHC_X],
+        pkt[EChannelType.ACCEL_LSM303DLHC_Y],
+        pkt[EChannelType.ACCEL_LSM303DLHC_Z],
+    ))
 
 def shimmer_thread():
     serial = Serial("COM6", DEFAULT_BAUDRATE)
@@ -292,7 +693,7 @@ def shimmer_thread():
         shim_dev.stop_streaming()
 
 if __name__ == "__main__":
-    import os
     if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
         threading.Thread(target=shimmer_thread, daemon=True).start()
+        threading.Thread(target=dsp_thread, daemon=True).start()
     app.run_server(debug=True)
@@ -10,8 +10,17 @@ import numpy as np
 import scipy.signal as signal
 import pandas as pd
 
+ACCEL_SCALE = 9.81 / 16000  # Przelicznik surowego odczytu na m/s^2 (1 g ≈ 9.81 m/s^2)
+
+# Wiersze x, y, z, absolutne przyspieszenie; prealokowane, żeby handler nie powiększał listy
+MAX_SAMPLES = 25 * 1024
+accels = np.empty((MAX_SAMPLES, 4), dtype=np.float32)
+accels_count = 0
+
 def handler(pkt: DataPacket) -> None:
-    global accels
+    global accels_count
+    if accels_count == MAX_SAMPLES:
+        return
     # Wyciągnij wartości z `pkt`
     timestamp = pkt[EChannelType.TIMESTAMP]
     accel_x = pkt[EChannelType.ACCEL_LSM303DLHC_X]
@@ -19,20 +28,18 @@ def handler(pkt: DataPacket) -> None:
     accel_z = pkt[EChannelType.ACCEL_LSM303DLHC_Z]
 
 
-    # Przelicz przyspieszenie na m/s^2 jeśli jest w milig (1 g ≈ 9.81 m/s^2)
-    accel_x = accel_x * 9.81 / 16000
-    accel_y = accel_y * 9.81 / 16000
-    accel_z = accel_z * 9.81 / 16000
+    # Przelicz przyspieszenie na m/s^2
+    accel_x *= ACCEL_SCALE
+    accel_y *= ACCEL_SCALE
+    accel_z *= ACCEL_SCALE
 
     # Oblicz absolutne przyspieszenie (norma wektora przyspieszenia)
-    absolute_acceleration = math.sqrt(accel_x**2 + accel_y**2 + accel_z**2)
+    absolute_acceleration = math.hypot(accel_x, accel_y, accel_z)
 
-    accels.append((accel_x, accel_y, accel_z, absolute_acceleration))
+    accels[accels_count] = (accel_x, accel_y, accel_z, absolute_acceleration)
+    accels_count += 1
 
 if __name__ == '__main__':
-    global accels
-    accels = []
-
     serial = Serial('COM6', DEFAULT_BAUDRATE)
     shim_dev = ShimmerBluetooth(serial)
 
@@ -46,7 +53,12 @@ if __name__ == '__main__':
     shim_dev.start_streaming()
     time.sleep(60)
     shim_dev.stop_streaming()
-    accels = pd.DataFrame(accels, columns=['accel_x', 'accel_y', 'accel_z', 'accel_absolute'])
-    accels.to_pickle("./accels10.pkl")
+    if accels_count == MAX_SAMPLES:
+        print(f'Buffer full, only the first {MAX_SAMPLES} samples were kept')
+    accels = pd.DataFrame(accels[:accels_count], columns=['accel_x', 'accel_y', 'accel_z', 'accel_absolute'])
+    try:
+        accels.to_parquet("./accels10.parquet", compression="zstd")
+    except ImportError:  # Parquet needs pyarrow or fastparquet, don't lose the capture without them
+        accels.to_pickle("./accels10.pkl")
     shim_dev.shutdown()
 